@@ -1,21 +1,44 @@
 # File: api/index.py
 
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from html import unescape
+import xml.etree.ElementTree as ET
+
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import yfinance as yf
+import orjson
+import redis
 import requests
-from bs4 import BeautifulSoup
-from difflib import get_close_matches
-from urllib.parse import unquote
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TLRUCache
+from cachetools.keys import hashkey
+from rapidfuzz import fuzz, process
 
 # ----------------------------
 # Initialize FastAPI App
 # ----------------------------
+class ORJSONResponse(JSONResponse):
+    """Serializes response bodies with orjson, which writes bytes directly and is faster than stdlib json."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
 app = FastAPI(
     title="Excellent Mirror - Advanced Stock Analysis API",
     description="An API to fetch financial data and categorized news for a single company.",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware to allow cross-origin requests
@@ -27,52 +50,270 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ----------------------------
+# Shared HTTP Session
+# ----------------------------
+# One pooled session keeps connections to Yahoo and Google News alive across calls.
+# Responses are requested compressed; `br` is decoded by urllib3 through the brotli package.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers.update({"User-Agent": "Mozilla/5.0", "Accept-Encoding": "gzip, deflate, br"})
+
+# ----------------------------
+# Cache (in-process + Redis)
+# ----------------------------
+# Empty results (errors, no matches) are kept only briefly so outages are absorbed
+# without pinning a bad answer for the full TTL.
+NEGATIVE_TTL = 60
+
+# Redis shares cached results across workers and survives cold starts. It is optional:
+# without REDIS_URL, or while Redis is unreachable, only the in-process cache is used.
+REDIS_URL = os.environ.get("REDIS_URL")
+RCLIENT = redis.Redis.from_url(REDIS_URL, socket_timeout=0.3, socket_connect_timeout=0.3, decode_responses=True) if REDIS_URL else None
+_MISS = object()
+
+def _redis_decode(key: str, cached_value):
+    """
+    Decodes a stored (value, fetched_at) cache entry, treating missing, undecodable or
+    wrongly shaped data (e.g. written by an older release) as _MISS.
+    """
+    if cached_value is None:
+        return _MISS
+    try:
+        entry = json.loads(cached_value)
+    except ValueError as e:
+        print(f"Ignoring undecodable Redis value for '{key}': {e}")
+        return _MISS
+    if not (
+        isinstance(entry, list) and len(entry) == 2
+        and isinstance(entry[1], (int, float)) and not isinstance(entry[1], bool)
+    ):
+        print(f"Ignoring malformed Redis entry for '{key}'")
+        return _MISS
+    return tuple(entry)
+
+def redis_get(key: str):
+    """Returns the cache entry stored under `key`, or _MISS if absent, corrupt or Redis is down."""
+    if RCLIENT is None:
+        return _MISS
+    try:
+        cached_value = RCLIENT.get(key)
+    except redis.RedisError as e:
+        print(f"Redis read failed for '{key}': {e}")
+        return _MISS
+    return _redis_decode(key, cached_value)
+
+def redis_get_many(keys: list):
+    """Like redis_get for several keys, fetched in a single MGET round trip."""
+    if RCLIENT is None or not keys:
+        return [_MISS] * len(keys)
+    try:
+        cached_values = RCLIENT.mget(keys)
+    except redis.RedisError as e:
+        print(f"Redis read failed for {len(keys)} keys: {e}")
+        return [_MISS] * len(keys)
+    return [_redis_decode(k, v) for k, v in zip(keys, cached_values)]
+
+def redis_set(key: str, ttl: int, value):
+    """Stores `value` under `key` for `ttl` seconds, ignoring Redis failures."""
+    if RCLIENT is None:
+        return
+    try:
+        RCLIENT.setex(key, ttl, json.dumps(value))
+    except redis.RedisError as e:
+        print(f"Redis write failed for '{key}': {e}")
+
+# Keys with a background refresh in flight, so a stale entry is only refreshed once at a time.
+REFRESHING: set = set()
+_REFRESHING_LOCK = threading.Lock()
+
+def ttl_cached(ttl: int, key=hashkey, redis_key=None, hard_ttl=None):
+    """
+    Caches a helper's results for `ttl` seconds, or NEGATIVE_TTL when the result is empty.
+    With `hard_ttl`, an entry older than `ttl` is still served until `hard_ttl` while a
+    background refresh on EXECUTOR replaces it (stale-while-revalidate).
+    When `redis_key` is given, misses in the in-process cache are looked up in Redis first,
+    and `prime()` can pull several entries from Redis into the in-process cache at once.
+    """
+    hard_ttl = hard_ttl or ttl
+
+    def decorator(func):
+        # Entries are (value, fetched_at) pairs; wall-clock time keeps ages comparable across workers.
+        cache = TLRUCache(
+            maxsize=1024,
+            ttu=lambda _key, entry, _now: entry[1] + (hard_ttl if entry[0] else NEGATIVE_TTL),
+            timer=time.time,
+        )
+        lock = threading.Lock()
+
+        def store(ckey, rkey, value):
+            entry = (value, time.time())
+            with lock:
+                cache[ckey] = entry
+            if rkey is not None:
+                redis_set(rkey, hard_ttl if value else NEGATIVE_TTL, entry)
+
+        def fetch(ckey, rkey, args, kwargs):
+            value = func(*args, **kwargs)
+            store(ckey, rkey, value)
+            return value
+
+        def refresh(refresh_key, ckey, rkey, args, kwargs):
+            try:
+                value = func(*args, **kwargs)
+                # A failed refresh keeps serving the stale entry until hard_ttl
+                if value:
+                    store(ckey, rkey, value)
+            finally:
+                with _REFRESHING_LOCK:
+                    REFRESHING.discard(refresh_key)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            ckey = key(*args, **kwargs)
+            rkey = redis_key(*args, **kwargs) if redis_key else None
+            with lock:
+                entry = cache.get(ckey)
+            if entry is None and rkey is not None:
+                shared_entry = redis_get(rkey)
+                if shared_entry is not _MISS:
+                    entry = shared_entry
+                    with lock:
+                        cache[ckey] = entry
+            if entry is None or time.time() - entry[1] >= hard_ttl:
+                return fetch(ckey, rkey, args, kwargs)
+
+            value, fetched_at = entry
+            if value and time.time() - fetched_at >= ttl:
+                refresh_key = (func.__name__, ckey)
+                with _REFRESHING_LOCK:
+                    start = refresh_key not in REFRESHING
+                    REFRESHING.add(refresh_key)
+                if start:
+                    EXECUTOR.submit(refresh, refresh_key, ckey, rkey, args, kwargs)
+            return value
+
+        def prime(calls: list):
+            """Loads Redis entries for several argument tuples into the in-process cache with one MGET."""
+            if RCLIENT is None or redis_key is None:
+                return
+            with lock:
+                missing = [args for args in calls if key(*args) not in cache]
+            shared_entries = redis_get_many([redis_key(*args) for args in missing])
+            with lock:
+                for args, shared_entry in zip(missing, shared_entries):
+                    if shared_entry is not _MISS:
+                        cache[key(*args)] = shared_entry
+
+        wrapper.prime = prime
+        return wrapper
+    return decorator
+
+def _web_search_key(query: str, num_results: int = 5):
+    return "ws2:" + hashlib.md5(f"{num_results}:{query}".encode()).hexdigest()
+
 # ----------------------------
 # Helper Functions
 # ----------------------------
 
+@functools.lru_cache(maxsize=None)
+def _yf():
+    """Imports yfinance on first use; it pulls in pandas, which would slow every cold start."""
+    import yfinance
+    return yfinance
+
+MAX_TICKER_CANDIDATES = 10
+
+@ttl_cached(
+    ttl=86400,
+    key=lambda company_name: hashkey(company_name.lower().strip()),
+    redis_key=lambda company_name: f"tk2:{company_name.lower().strip()}",
+)
 def search_ticker(company_name: str):
     """Searches for the most relevant stock ticker for a given company name."""
-    url = f"https://query2.finance.yahoo.com/v1/finance/search?q={company_name}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    url = "https://query2.finance.yahoo.com/v1/finance/search"
+    # Only the top quotes are ever useful, and the news block is never read
+    params = {"q": company_name, "quotesCount": MAX_TICKER_CANDIDATES, "newsCount": 0}
     try:
-        res = requests.get(url, headers=headers, timeout=10)
+        res = SESSION.get(url, params=params, timeout=10)
         res.raise_for_status()
-        data = res.json()
-        quotes = data.get('quotes', [])
+        data = orjson.loads(res.content)
+        quotes = data.get('quotes', [])[:MAX_TICKER_CANDIDATES]
         if not quotes:
             return None
         
-        names = [q.get('longname') or q.get('shortname', '') for q in quotes]
-        best_match_name = get_close_matches(company_name, names, n=1, cutoff=0.6)
-        
-        if not best_match_name:
-            return quotes[0].get('symbol')
-
+        # Fast path: an exact or substring name match needs no fuzzy scoring
+        cn_lower = company_name.strip().casefold()
+        names = []
         for quote in quotes:
-            if (quote.get('longname') or quote.get('shortname')) == best_match_name[0]:
+            name = quote.get('longname') or quote.get('shortname') or ''
+            if cn_lower in name.casefold():
                 return quote.get('symbol')
+            names.append(name)
+
+        match = process.extractOne(company_name, names, scorer=fuzz.WRatio, score_cutoff=60)
         
-        return quotes[0].get('symbol')
+        if not match:
+            return quotes[0].get('symbol')
+
+        # extractOne returns (name, score, index), so the index points straight into quotes
+        return quotes[match[2]].get('symbol')
         
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error fetching ticker for {company_name}: {e}")
         return None
 
+def _closes_to_history(timestamps, closes, gmtoffset: int = 0):
+    """Pairs Yahoo epoch timestamps with closing prices, dropping days without a close."""
+    return [
+        {"date": datetime.fromtimestamp(ts + gmtoffset, tz=timezone.utc).date().isoformat(), "close": round(close, 2)}
+        for ts, close in zip(timestamps or [], closes or [])
+        if close is not None
+    ]
+
+def _fetch_prices(ticker: str):
+    """Returns a ticker's price fields, including closes for the last month, from Yahoo's chart API."""
+    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
+    res = SESSION.get(url, params={"range": "1mo", "interval": "1d"}, timeout=10)
+    res.raise_for_status()
+    chart = orjson.loads(res.content)["chart"]
+    if not chart.get("result"):
+        raise ValueError(f"No chart data: {chart.get('error')}")
+
+    result = chart["result"][0]
+    meta = result.get("meta", {})
+    closes = result.get("indicators", {}).get("quote", [{}])[0].get("close")
+    price, low, high = (meta.get(k) for k in ("regularMarketPrice", "fiftyTwoWeekLow", "fiftyTwoWeekHigh"))
+    return {
+        "current_price": round(price, 2) if price is not None else None,
+        "fifty_two_week_range": f"{low} - {high}",
+        "historical_prices": _closes_to_history(result.get("timestamp"), closes, meta.get("gmtoffset", 0)),
+    }
+
+@ttl_cached(ttl=300, hard_ttl=900, redis_key=lambda ticker: f"sd2:{ticker}")
 def get_stock_data(ticker: str):
-    """Fetches comprehensive stock data from yfinance for the last month."""
-    stock = yf.Ticker(ticker)
+    """
+    Fetches stock data for the last month.
+    Prices come straight from Yahoo's chart API; the company profile and valuation fields
+    come from yfinance's full quote summary.
+    """
+    stock = _yf().Ticker(ticker)
     try:
-        info = stock.info
+        # The profile and the price history are separate Yahoo endpoints, so fetch them together.
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            f_info = ex.submit(stock.get_info)
+            f_prices = ex.submit(_fetch_prices, ticker)
+            info = f_info.result()
+            prices = f_prices.result()
+
         if not info or info.get('trailingPE') is None:
-             return None
-             
-        # MODIFIED: Changed period from "1y" to "1mo"
-        hist = stock.history(period="1mo") 
-        hist_data = [
-            {"date": str(index.date()), "close": round(row['Close'], 2)}
-            for index, row in hist.iterrows()
-        ]
+            return None
 
         return {
             "ticker": ticker,
@@ -81,59 +322,141 @@ def get_stock_data(ticker: str):
             "sector": info.get('sector', 'N/A'),
             "industry": info.get('industry', 'N/A'),
             "summary": info.get('longBusinessSummary', 'N/A'),
-            "current_price": info.get('currentPrice'),
+            "current_price": prices["current_price"],
             "market_cap": info.get('marketCap'),
-            "fifty_two_week_range": f"{info.get('fiftyTwoWeekLow')} - {info.get('fiftyTwoWeekHigh')}",
+            "fifty_two_week_range": prices["fifty_two_week_range"],
             "pe_ratio": info.get('trailingPE'),
             "eps": info.get('trailingEps'),
             "dividend_yield": info.get('dividendYield'),
             "recommendation": info.get('recommendationKey', 'N/A').replace('_', ' ').title(),
             "target_mean_price": info.get('targetMeanPrice'),
-            "historical_prices": hist_data,
+            "historical_prices": prices["historical_prices"],
         }
     except Exception as e:
         print(f"Error fetching data for ticker {ticker}: {e}")
         return None
 
+# Yahoo's spark endpoint accepts at most this many symbols per request.
+SPARK_CHUNK_SIZE = 20
+
+@ttl_cached(ttl=300)
+def get_price_history_batch(symbols: tuple):
+    """
+    Fetches a month of daily closes for up to SPARK_CHUNK_SIZE symbols in one Yahoo spark request.
+    Dates are shifted by each symbol's exchange `gmtoffset`, as in `_fetch_prices`, so they match
+    /api/analyze; if Yahoo omits the offset for a symbol, its dates fall back to UTC.
+    """
+    url = "https://query1.finance.yahoo.com/v8/finance/spark"
+    params = {"symbols": ",".join(symbols), "range": "1mo", "interval": "1d", "indicators": "close"}
+    try:
+        res = SESSION.get(url, params=params, timeout=10)
+        res.raise_for_status()
+        data = orjson.loads(res.content)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching price history for {', '.join(symbols)}: {e}")
+        return {}
+
+    histories = {}
+    for symbol in symbols:
+        series = data.get(symbol) or {}
+        gmtoffset = series.get("gmtoffset") or series.get("meta", {}).get("gmtoffset") or 0
+        hist_data = _closes_to_history(series.get("timestamp"), series.get("close"), gmtoffset)
+        histories[symbol] = {
+            "current_price": hist_data[-1]["close"] if hist_data else None,
+            "historical_prices": hist_data,
+        }
+    return histories
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+@ttl_cached(
+    ttl=600,
+    hard_ttl=3600,
+    key=lambda query, num_results=5: hashkey(query, num_results),
+    redis_key=_web_search_key,
+)
 def web_search(query: str, num_results: int = 5):
     """
-    NEW: Performs a web search using DuckDuckGo and returns structured results.
+    Searches Google News through its RSS feed and returns structured results.
     """
-    url = f"https://duckduckgo.com/html/?q={query}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    url = "https://news.google.com/rss/search"
+    params = {"q": query, "hl": "en-IN", "gl": "IN", "ceid": "IN:en"}
     try:
-        res = requests.get(url, headers=headers, timeout=10)
+        res = SESSION.get(url, params=params, timeout=10)
         res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        root = ET.fromstring(res.content)
 
         results = []
-        for result in soup.select('.result')[:num_results]:
-            title_tag = result.select_one('.result__a')
-            link_tag = result.select_one('.result__a')
-            snippet_tag = result.select_one('.result__snippet')
-
-            if not (title_tag and link_tag and snippet_tag):
+        for item in root.findall(".//item")[:num_results]:
+            title = item.findtext("title")
+            link = item.findtext("link")
+            if not (title and link):
                 continue
-                
-            title = title_tag.get_text()
-            # Clean up the DDG redirect link
-            raw_link = link_tag['href']
-            cleaned_link = unquote(raw_link.split('/l/?uddg=')[-1].split('&rut=')[0])
-            snippet = snippet_tag.get_text()
-            
-            results.append({"title": title, "link": cleaned_link, "snippet": snippet})
+
+            # The description is a small HTML fragment; keep only its text
+            description = item.findtext("description") or ""
+            snippet = " ".join(unescape(_TAG_RE.sub(" ", description)).split())
+
+            results.append({
+                "title": title,
+                "link": link,
+                "snippet": snippet,
+                "source": item.findtext("source"),
+                "published": item.findtext("pubDate"),
+            })
         
         return results
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ET.ParseError) as e:
         print(f"Error performing web search for '{query}': {e}")
         return []
 
+# News searches run for every analyzed company, keyed by their category in the response
+NEWS_CATEGORIES = {
+    "company_news": "news about {}",
+    "financial_news": "{} financial news OR earnings",
+    "investor_relations": "investors of {} OR shareholder updates",
+    "market_outlook": "{} market analysis and future outlook"
+}
+
+# Dedicated pool for the blocking upstream calls, sized for one request's news fan-out.
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+NEWS_TIMEOUT = 15
+
+async def run_blocking(func, *args):
+    """Runs a blocking helper on EXECUTOR so the event loop stays free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR, functools.partial(func, *args))
+
+# Upstream fetches currently running, keyed per helper call; see singleflight().
+INFLIGHT: dict = {}
+
+async def singleflight(key, func, *args):
+    """
+    Runs `func(*args)` on EXECUTOR, sharing one in-flight call among concurrent callers
+    with the same `key` so a burst of identical cold requests reaches upstream only once.
+    """
+    task = INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(run_blocking(func, *args))
+        INFLIGHT[key] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(key, None))
+    # Shielded so a caller that gives up does not cancel the fetch for the others
+    return await asyncio.shield(task)
+
+async def search_news(query: str):
+    """Runs web_search off the event loop, giving up with no results after NEWS_TIMEOUT seconds."""
+    try:
+        return await asyncio.wait_for(singleflight(("ws", query), web_search, query), timeout=NEWS_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Web search for '{query}' timed out")
+        return []
+
 # ----------------------------
 # API Endpoint
 # ----------------------------
 
 @app.get("/api/analyze", tags=["Stock Analysis"])
-def analyze_company(company_name: str = Query(..., description="The name of the company to analyze.")):
+async def analyze_company(company_name: str = Query(..., description="The name of the company to analyze.")):
     """
     Provides a full financial analysis for a single company by its name, 
     including categorized news from a web search.
@@ -142,25 +465,25 @@ def analyze_company(company_name: str = Query(..., description="The name of the
         raise HTTPException(status_code=400, detail="Company name cannot be empty.")
 
     # 1. Find the best ticker symbol
-    ticker = search_ticker(company_name)
+    ticker = await singleflight(("ticker", company_name.lower().strip()), search_ticker, company_name)
     if not ticker:
         raise HTTPException(status_code=404, detail=f"Could not find a stock ticker for '{company_name}'.")
 
     # 2. Get stock financial data
-    stock_data = get_stock_data(ticker)
+    stock_data = await singleflight(("sd", ticker), get_stock_data, ticker)
     if not stock_data:
         raise HTTPException(status_code=404, detail=f"Could not retrieve financial data for ticker '{ticker}'. The company might be delisted or data is unavailable.")
 
     # 3. Get official company name for better search results
     official_name = stock_data.get('company_name', company_name)
 
-    # 4. Perform categorized news searches
-    news_analysis = {
-        "company_news": web_search(f"news about {official_name}"),
-        "financial_news": web_search(f"{official_name} financial news OR earnings"),
-        "investor_relations": web_search(f"investors of {official_name} OR shareholder updates"),
-        "market_outlook": web_search(f"{official_name} market analysis and future outlook")
-    }
+    # 4. Perform categorized news searches concurrently
+    queries = {category: template.format(official_name) for category, template in NEWS_CATEGORIES.items()}
+    # One Redis round trip for all searches; only the misses go upstream
+    if RCLIENT is not None:
+        await run_blocking(web_search.prime, [(q,) for q in queries.values()])
+    results = await asyncio.gather(*(search_news(q) for q in queries.values()))
+    news_analysis = dict(zip(queries, results))
 
     # 5. Combine and return the results
     response_data = {
@@ -169,7 +492,49 @@ def analyze_company(company_name: str = Query(..., description="The name of the
         "news_analysis": news_analysis
     }
     
-    return JSONResponse(content=response_data)
+    return ORJSONResponse(content=response_data)
+
+MAX_BATCH_SIZE = 50
+
+@app.get("/api/analyze_batch", tags=["Stock Analysis"])
+async def analyze_batch(company_names: list[str] = Query(..., description="The names of the companies to analyze.")):
+    """
+    Resolves several companies to their tickers and returns their prices for the last month.
+    Profiles and news are left to /api/analyze for the companies the user expands.
+    Dates are exchange-local, or UTC for symbols Yahoo returns without a UTC offset.
+    """
+    names = [name for name in company_names if name.strip()]
+    if not names:
+        raise HTTPException(status_code=400, detail="Company names cannot be empty.")
+    if len(names) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} companies can be analyzed at once.")
+
+    # 1. Resolve all tickers in parallel
+    tickers = await asyncio.gather(
+        *(singleflight(("ticker", name.lower().strip()), search_ticker, name) for name in names)
+    )
+
+    # 2. Fetch price history with one request per SPARK_CHUNK_SIZE symbols
+    symbols = list(dict.fromkeys(t for t in tickers if t))
+    chunks = [tuple(symbols[i:i + SPARK_CHUNK_SIZE]) for i in range(0, len(symbols), SPARK_CHUNK_SIZE)]
+    histories = {}
+    for chunk_histories in await asyncio.gather(
+        *(singleflight(("spark", c), get_price_history_batch, c) for c in chunks)
+    ):
+        histories.update(chunk_histories)
+
+    # 3. Combine and return the results
+    results = []
+    for name, ticker in zip(names, tickers):
+        prices = histories.get(ticker, {})
+        results.append({
+            "query": name,
+            "ticker": ticker,
+            "current_price": prices.get("current_price"),
+            "historical_prices": prices.get("historical_prices", []),
+        })
+
+    return ORJSONResponse(content={"results": results})
 
 # Health check endpoint for Vercel
 @app.get("/api/health", tags=["Health Check"])